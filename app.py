@@ -1,13 +1,17 @@
 import streamlit as st
 import pandas as pd
+import hashlib
 import json
+import orjson
 import os
 import re
 import glob
 import subprocess
 import unicodedata
 import plotly.express as px
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from openpyxl import load_workbook
 
 # ==============================================================================
 # CONFIG
@@ -19,26 +23,88 @@ REPO_PATH = os.getcwd()
 API_OUTPUT_PATH = os.path.join(REPO_PATH, "public", "data")
 DEFAULT_BRANCH = "main"  # cambia a "master" si tu repo usa master
 
+# Motor de lectura de Excel: calamine (Rust, ~10-30x más rápido) si está
+# instalado (pip install python-calamine); si no, openpyxl como siempre.
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = "openpyxl"
+
 
 # ==============================================================================
 # HELPERS
 # ==============================================================================
+# Patrones compilados una sola vez a nivel de módulo (re.sub con string
+# re-parsea el patrón en cada llamada si se cae del cache interno de re)
+_WS_RE = re.compile(r"\s+")
+_FECHA_RE = re.compile(r"(?P<y>\d{4})\s*/\s*(?P<mo>\d{2})")
+_JUNK_RE = re.compile(r"^(?:L[OA]S DEMÁS|OTR[OA]S)\s*|\(.*?\)")
+# tabla de traducción que elimina puntos y espacios del código en una pasada
+_COD_TR = str.maketrans("", "", ". ")
+
+
 def norm(txt):
     txt = "" if txt is None else str(txt)
     txt = txt.strip().lower()
     txt = ''.join(c for c in unicodedata.normalize("NFD", txt)
                   if unicodedata.category(c) != "Mn")
-    txt = re.sub(r"\s+", " ", txt)
+    txt = _WS_RE.sub(" ", txt)
     return txt
 
 
 def find_header_row(filepath, max_rows=40):
-    preview = pd.read_excel(filepath, header=None, nrows=max_rows, engine="openpyxl")
-    for i in range(len(preview)):
-        row = [norm(x) for x in preview.iloc[i].tolist()]
-        if "codigo subpartida" in row and "periodo" in row:
-            return i
-    return None
+    # escaneo directo con openpyxl en modo read_only: milisegundos por
+    # archivo, sin levantar toda la maquinaria de pd.read_excel
+    wb = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        ws = wb.active
+        for i, row in enumerate(ws.iter_rows(max_row=max_rows, values_only=True)):
+            normed = {norm(c) for c in row if c is not None}
+            if "codigo subpartida" in normed and "periodo" in normed:
+                return i
+        return None
+    finally:
+        wb.close()
+
+
+def write_records_json(df, path):
+    """Escribe un JSON [records] en streaming con orjson, registro a registro,
+    sin materializar el string completo en memoria como hace to_json."""
+    with open(path, "wb") as f:
+        f.write(b"[")
+        for i, rec in enumerate(df.to_dict("records")):
+            if i:
+                f.write(b",")
+            f.write(orjson.dumps(rec, option=orjson.OPT_SERIALIZE_NUMPY))
+        f.write(b"]")
+
+
+MANIFEST_PATH = os.path.join(API_OUTPUT_PATH, "manifest.json")
+
+
+def _file_fingerprint(path):
+    """(tamaño, mtime_ns, sha1 de los primeros 64 KB) — basta para detectar cambios."""
+    info = os.stat(path)
+    with open(path, "rb") as f:
+        digest = hashlib.sha1(f.read(65536)).hexdigest()
+    return [info.st_size, info.st_mtime_ns, digest]
+
+
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(manifest):
+    # escritura atómica: si algo truena a mitad no corrompemos el manifest
+    tmp = MANIFEST_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp, MANIFEST_PATH)
 
 
 def run(cmd, cwd=None):
@@ -49,33 +115,143 @@ def run(cmd, cwd=None):
     return res.stdout.strip()
 
 
+# columnas (ya normalizadas con norm) que realmente usa el ETL:
+# el resto ni siquiera se parsea gracias a usecols
+WANTED_COLS = {
+    "periodo", "pais origen", "pais de origen",
+    "codigo subpartida", "subpartida", "descripcion",
+    "tm (peso neto)", "peso neto", "fob", "cif",
+}
+
+
+# Sector por capítulo arancelario (2 primeros dígitos de la subpartida)
+SECTORS = {
+    '03': '🦐 Pesca', '07': '🥦 Hortalizas', '08': '🍌 Frutas',
+    '16': '🥫 Conservas', '18': '🍫 Cacao',
+    '29': '🧪 Químicos', '30': '💊 Farma',
+    '39': '🧴 Plásticos', '44': '🪵 Madera',
+    '72': '🏗️ Hierro/Acero',
+    '84': '⚙️ Maquinaria', '85': '🔌 Eléctrico',
+    '87': '🚗 Vehículos'
+}
+
+
+def load_and_clean(filepath):
+    """Lee y limpia un Excel completo. Lanza ValueError si faltan columnas."""
+    header_idx = find_header_row(filepath)
+    if header_idx is None:
+        raise ValueError("No se detectó encabezado (Período + Código Subpartida)")
+
+    df = pd.read_excel(filepath, header=header_idx, dtype=str, engine=EXCEL_ENGINE,
+                       usecols=lambda c: norm(c) in WANTED_COLS)
+    # strings respaldados por Arrow: ~3-5x menos memoria que object dtype
+    # y las operaciones .str corren en los kernels C de Arrow
+    df = df.convert_dtypes(dtype_backend="pyarrow")
+    df.columns = df.columns.astype(str).str.strip()
+
+    # columnas normalizadas
+    norm_cols = {norm(c): c for c in df.columns}
+
+    def pick(*opts):
+        for o in opts:
+            if o in norm_cols:
+                return norm_cols[o]
+        return None
+
+    rename = {}
+    rename[pick("periodo", "período")] = "fecha_txt"
+    rename[pick("pais origen", "país origen", "pais de origen", "país de origen")] = "pais"
+    rename[pick("codigo subpartida", "código subpartida")] = "cod"
+    rename[pick("subpartida", "descripcion", "descripción")] = "desc"
+    rename[pick("tm (peso neto)", "peso neto")] = "peso"
+    rename[pick("fob")] = "fob"
+    rename[pick("cif")] = "cif"
+    rename = {k: v for k, v in rename.items() if k is not None}
+
+    df = df.rename(columns=rename)
+
+    if "cod" not in df.columns or "fecha_txt" not in df.columns:
+        raise ValueError(f"Faltan columnas clave. Halladas: {list(df.columns)}")
+
+    # Fecha "YYYY / MM - Mes" -> "YYYY-MM-01" (regex vectorizada, sin apply)
+    # .pattern: los accessors .str sobre columnas Arrow no aceptan
+    # re.Pattern compilados (el backend re2/pyarrow recompila el string)
+    ym = df["fecha_txt"].str.extract(_FECHA_RE.pattern)
+    df["fecha"] = ym["y"] + "-" + ym["mo"] + "-01"
+    df = df.dropna(subset=["fecha", "cod"])
+
+    # numéricos
+    for c in ["fob", "cif", "peso"]:
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c], errors="coerce", dtype_backend="pyarrow").fillna(0)
+
+    df["cod"] = df["cod"].str.translate(_COD_TR).str.zfill(10)
+    df["sector"] = df["cod"].str[:2].map(SECTORS).fillna('📦 Otros')
+    # limpiar descripciones de forma vectorizada ("LOS DEMÁS...", paréntesis)
+    df["label"] = (
+        df["desc"].fillna("Desconocido")
+        .str.upper()
+        .str.replace(_JUNK_RE.pattern, "", regex=True)
+        .str.strip()
+        .str.capitalize()
+        .replace("", "Desconocido")
+    )
+    return df
+
+
+def process_one(filepath):
+    """Procesa un Excel completo y devuelve sus particiones anuales.
+
+    Corre en un subproceso del pool (por eso vive a nivel de módulo).
+    La escritura queda en el padre: dos archivos del mismo tipo+año no
+    deben escribir el mismo {yr}.json en paralelo.
+    Devuelve (tipo, [(año, frame)]) o lanza ValueError/Exception.
+    """
+    filename = os.path.basename(filepath)
+    tipo = "exports" if "export" in filename.lower() else "imports"
+
+    df = load_and_clean(filepath)
+
+    cols = ["fecha", "cod", "label", "sector", "fob", "cif", "peso"]
+    # una sola pasada sobre el frame en vez de un scan de fechas por año
+    partitions = [(yr, sub[cols]) for yr, sub in df.groupby(df["fecha"].str[:4], sort=True)]
+    return tipo, partitions
+
+
+def write_year_partition(tipo, yr, sub):
+    """Escribe el JSON público y el Parquet local de un año y devuelve su
+    fila de summary."""
+    out_dir = os.path.join(API_OUTPUT_PATH, tipo)
+    os.makedirs(out_dir, exist_ok=True)
+
+    write_records_json(sub, os.path.join(out_dir, f"{yr}.json"))
+    # Parquet para consumo local (dashboard): columnar, tipado y
+    # comprimido, ~10x más chico y mucho más rápido de leer que JSON
+    sub.to_parquet(os.path.join(out_dir, f"{yr}.parquet"),
+                   compression="snappy", index=False)
+
+    total = sub["cif"].sum() if tipo == "imports" else sub["fob"].sum()
+    return {"year": yr, "total": round(float(total), 2), "file": f"{yr}.json"}
+
+
+# Lecturas del dashboard: cachear por (ruta, mtime) evita reparsear el
+# archivo del año en cada rerun de Streamlit (cada click de widget).
+@st.cache_data(show_spinner=False)
+def load_year(path, mtime):
+    return pd.read_parquet(path) if path.endswith(".parquet") else pd.read_json(path)
+
+
+@st.cache_data(show_spinner=False)
+def load_summary(path, mtime):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
 # ==============================================================================
 # ETL ENGINE
 # ==============================================================================
 class ETLEngine:
 
-    def clean_text(self, text):
-        if not isinstance(text, str):
-            return "Desconocido"
-        txt = text.strip().upper()
-        for p in [r"^LOS DEMÁS\s*", r"^LAS DEMÁS\s*", r"^OTROS\s*", r"^OTRAS\s*", r"\(.*?\)"]:
-            txt = re.sub(p, "", txt)
-        txt = txt.strip()
-        return txt.capitalize() if txt else "Desconocido"
-
-    def get_sector(self, code):
-        cap = str(code)[:2]
-        sectors = {
-            '03': '🦐 Pesca', '07': '🥦 Hortalizas', '08': '🍌 Frutas',
-            '16': '🥫 Conservas', '18': '🍫 Cacao',
-            '29': '🧪 Químicos', '30': '💊 Farma',
-            '39': '🧴 Plásticos', '44': '🪵 Madera',
-            '72': '🏗️ Hierro/Acero',
-            '84': '⚙️ Maquinaria', '85': '🔌 Eléctrico',
-            '87': '🚗 Vehículos'
-        }
-        return sectors.get(cap, '📦 Otros')
-
     def run_process(self, status):
         status.write(f"📂 Leyendo: `{RAW_DATA_PATH}`")
 
@@ -88,111 +264,84 @@ class ETLEngine:
             status.error("❌ No se encontraron .xlsx válidos (ojo: se ignoran ~$.xlsx).")
             return False
 
-        resumen = {"imports": [], "exports": []}
+        # dict por año: el último archivo procesado de un año gana, sin
+        # reconstruir la lista completa en cada iteración
+        resumen = {"imports": {}, "exports": {}}
         processed = 0
 
         os.makedirs(API_OUTPUT_PATH, exist_ok=True)
 
+        def merge_summary(tipo, summary_rows):
+            for row in summary_rows:
+                resumen[tipo][row["year"]] = row
+
+        # manifest: archivos sin cambios desde la última corrida se saltan
+        manifest = load_manifest()
+        pending = []
         for filepath in sorted(files):
             filename = os.path.basename(filepath)
-            status.write(f"🔄 {filename}")
-
-            tipo = "exports" if "export" in filename.lower() else "imports"
-
-            try:
-                header_idx = find_header_row(filepath)
-                if header_idx is None:
-                    status.warning(f"⚠️ No se detectó encabezado (Período + Código Subpartida) en {filename}")
-                    continue
-
-                df = pd.read_excel(filepath, header=header_idx, dtype=str, engine="openpyxl")
-                df.columns = df.columns.astype(str).str.strip()
-                df = df.loc[:, ~df.columns.str.contains("^Unnamed", na=False)]
-
-                # columnas normalizadas
-                norm_cols = {norm(c): c for c in df.columns}
-
-                def pick(*opts):
-                    for o in opts:
-                        if o in norm_cols:
-                            return norm_cols[o]
-                    return None
-
-                rename = {}
-                rename[pick("periodo", "período")] = "fecha_txt"
-                rename[pick("pais origen", "país origen", "pais de origen", "país de origen")] = "pais"
-                rename[pick("codigo subpartida", "código subpartida")] = "cod"
-                rename[pick("subpartida", "descripcion", "descripción")] = "desc"
-                rename[pick("tm (peso neto)", "peso neto")] = "peso"
-                rename[pick("fob")] = "fob"
-                rename[pick("cif")] = "cif"
-                rename = {k: v for k, v in rename.items() if k is not None}
-
-                df = df.rename(columns=rename)
-
-                if "cod" not in df.columns or "fecha_txt" not in df.columns:
-                    status.warning(f"⚠️ Faltan columnas clave en {filename}. Halladas: {list(df.columns)}")
-                    continue
-
-                # Fecha "YYYY / MM - Mes" -> "YYYY-MM-01"
-                def parse_fecha(txt):
-                    m = re.search(r"(\d{4})\s*/\s*(\d{2})", str(txt))
-                    return f"{m.group(1)}-{m.group(2)}-01" if m else None
-
-                df["fecha"] = df["fecha_txt"].apply(parse_fecha)
-                df = df.dropna(subset=["fecha", "cod"])
-
-                # numéricos
-                for c in ["fob", "cif", "peso"]:
-                    if c in df.columns:
-                        df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0)
-
-                df["cod"] = df["cod"].astype(str).str.replace(".", "", regex=False).str.strip().str.zfill(10)
-                df["sector"] = df["cod"].apply(self.get_sector)
-                df["label"] = df["desc"].apply(self.clean_text)
-
-                years = sorted(df["fecha"].str[:4].unique())
-
-                out_dir = os.path.join(API_OUTPUT_PATH, tipo)
-                os.makedirs(out_dir, exist_ok=True)
-
-                for yr in years:
-                    sub = df[df["fecha"].str.startswith(yr)].copy()
-                    cols = ["fecha", "cod", "label", "sector", "fob", "cif", "peso"]
-                    sub[cols].to_json(os.path.join(out_dir, f"{yr}.json"), orient="records")
-
-                    total = sub["cif"].sum() if tipo == "imports" else sub["fob"].sum()
-                    resumen[tipo] = [x for x in resumen[tipo] if x["year"] != yr]
-                    resumen[tipo].append({"year": yr, "total": round(float(total), 2), "file": f"{yr}.json"})
-
+            fp = _file_fingerprint(filepath)
+            entry = manifest.get(filename)
+            if entry and entry.get("fingerprint") == fp:
+                merge_summary(entry["tipo"], entry["summary_rows"])
                 processed += 1
-
-            except Exception as e:
-                status.error(f"❌ Error en {filename}: {e}")
+                status.write(f"⏭️ {filename} (sin cambios)")
+            else:
+                pending.append((filepath, fp))
+
+        # cada archivo es independiente y el parseo es CPU-bound:
+        # un proceso por archivo escala casi lineal con los cores.
+        # Los workers solo parsean; el padre escribe en orden de envío
+        # (= orden sorted de archivos), así dos fuentes del mismo tipo+año
+        # no pisan el mismo {yr}.json en paralelo y el último gana
+        # determinísticamente, igual que en el flujo secuencial.
+        if pending:
+            with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+                futures = {pool.submit(process_one, f): (os.path.basename(f), fp)
+                           for f, fp in pending}
+                for fut, (filename, fp) in futures.items():
+                    try:
+                        tipo, partitions = fut.result()
+                        summary_rows = [
+                            write_year_partition(tipo, yr, sub)
+                            for yr, sub in partitions
+                        ]
+                        merge_summary(tipo, summary_rows)
+                        manifest[filename] = {
+                            "fingerprint": fp,
+                            "tipo": tipo,
+                            "summary_rows": summary_rows,
+                        }
+
+                        processed += 1
+                        status.write(f"🔄 {filename} ✔")
+
+                    except ValueError as e:
+                        status.warning(f"⚠️ {e} en {filename}")
+                    except Exception as e:
+                        status.error(f"❌ Error en {filename}: {e}")
+
+        save_manifest(manifest)
 
         # escribir summary.json
         for t in resumen:
             if resumen[t]:
-                resumen[t].sort(key=lambda x: x["year"], reverse=True)
+                data = sorted(resumen[t].values(), key=lambda x: x["year"], reverse=True)
                 sum_path = os.path.join(API_OUTPUT_PATH, t, "summary.json")
                 with open(sum_path, "w", encoding="utf-8") as f:
-                    json.dump(resumen[t], f, ensure_ascii=False)
+                    json.dump(data, f, ensure_ascii=False)
 
         status.success(f"✅ ETL completo: {processed} archivos procesados.")
         return processed > 0
 
     def git_push_changes(self):
         try:
-            # ver estado
-            run(["git", "status"], cwd=REPO_PATH)
-
             # add + commit (solo si hay cambios)
             run(["git", "add", "public/data"], cwd=REPO_PATH)
 
-            # si no hay cambios staged, commit falla; lo manejamos
-            diff = subprocess.run(["git", "diff", "--cached", "--name-only"], cwd=REPO_PATH,
-                                  capture_output=True, text=True)
-            if not diff.stdout.strip():
+            # --quiet devuelve 0 si no hay nada staged, sin capturar texto
+            rc = subprocess.run(["git", "diff", "--cached", "--quiet"], cwd=REPO_PATH).returncode
+            if rc == 0:
                 return True, "No había cambios nuevos en public/data (nada que subir)."
 
             msg = f"Update trade APIs {datetime.now().strftime('%Y-%m-%d %H:%M')}"
@@ -246,15 +395,18 @@ elif page == "📊 Dashboard (local)":
         st.info("No hay summary.json aún. Ve a Admin ETL y procesa.")
         st.stop()
 
-    years = [x["year"] for x in json.load(open(summary_path, encoding="utf-8"))]
+    years = [x["year"] for x in load_summary(summary_path, os.path.getmtime(summary_path))]
     year = st.selectbox("Año", years)
 
+    parquet_path = os.path.join(API_OUTPUT_PATH, flujo, f"{year}.parquet")
     data_path = os.path.join(API_OUTPUT_PATH, flujo, f"{year}.json")
-    if not os.path.exists(data_path):
-        st.warning("No existe el JSON del año seleccionado.")
+    if os.path.exists(parquet_path):
+        df = load_year(parquet_path, os.path.getmtime(parquet_path))
+    elif os.path.exists(data_path):
+        df = load_year(data_path, os.path.getmtime(data_path))
+    else:
+        st.warning("No existe el Parquet/JSON del año seleccionado.")
         st.stop()
-
-    df = pd.read_json(data_path)
     val = "cif" if flujo == "imports" else "fob"
     st.metric("Total USD", f"${df[val].sum():,.0f}")
 
@@ -1,13 +1,30 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
-import json
+import orjson
 import os
 import re
 import glob
 import subprocess
 import unicodedata
 import plotly.express as px
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from openpyxl import load_workbook
+
+# openpyxl usa lxml (parser C de libxml2) automáticamente si es importable:
+# 2-4x más rápido que xml.etree para shared-strings y hojas grandes
+try:
+    import lxml  # noqa: F401
+except ImportError:
+    lxml = None
+
+# DuckDB agrega directo sobre el JSON (parser SIMD + groupby columnar)
+# sin cargar el año completo en memoria; si no está, cae a pandas
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
 
 # ==============================================================================
 # CONFIG
@@ -27,15 +44,20 @@ DEFAULT_BRANCH = "main"
 # ==============================================================================
 # HELPERS
 # ==============================================================================
+# norm corre sobre cada nombre de columna Y cada celda del escaneo de
+# encabezados: regex precompilado y tabla de str.translate que quita las
+# marcas combinantes (categoría Mn) en C, sin genexp por carácter
+_WS_RE = re.compile(r"\s+")
+_COMBINING = dict.fromkeys(
+    c for c in range(0x10000) if unicodedata.category(chr(c)) == "Mn"
+)
+
+
 def norm(txt):
-    txt = "" if txt is None else str(txt)
-    txt = txt.strip().lower()
-    txt = "".join(
-        c for c in unicodedata.normalize("NFD", txt)
-        if unicodedata.category(c) != "Mn"
-    )
-    txt = re.sub(r"\s+", " ", txt)
-    return txt
+    if txt is None:
+        return ""
+    s = unicodedata.normalize("NFD", str(txt)).translate(_COMBINING)
+    return _WS_RE.sub(" ", s.strip().lower())
 
 def run(cmd, cwd=None):
     res = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True)
@@ -43,42 +65,182 @@ def run(cmd, cwd=None):
         raise RuntimeError(res.stderr.strip() or res.stdout.strip() or "Error ejecutando comando")
     return res.stdout.strip()
 
-def find_header_row(filepath, max_rows=80, sheet_name=None):
+def _load_sheet_rows(filepath):
+    """Abre el workbook UNA sola vez en modo read_only (sin estilos ni
+    fórmulas, celdas liberadas al vuelo) y devuelve las filas de la primera
+    hoja como lista de tuplas."""
+    wb = load_workbook(filepath, read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb[wb.sheetnames[0]]
+        return list(ws.iter_rows(values_only=True))
+    finally:
+        wb.close()
+
+
+def find_header_row(rows, max_rows=80):
     """
     En tus CUODE, el header real suele verse así:
     Período | Código Grupo | Grupo | Código Subgrupo | Subgrupo | Código Subpartida | Subpartida | TM (Peso Neto) | FOB | CIF
     """
-    preview = pd.read_excel(filepath, sheet_name=sheet_name, header=None, nrows=max_rows, engine="openpyxl")
-    for i in range(len(preview)):
-        row = [norm(x) for x in preview.iloc[i].tolist()]
-        has_periodo = ("periodo" in row)  # norm quita acentos
-        has_cod_subpartida = ("codigo subpartida" in row)
-        if has_periodo and has_cod_subpartida:
+    for i, row in enumerate(rows[:max_rows]):
+        # set: membership O(1); las celdas vacías (None) ni se normalizan
+        normed = {norm(x) for x in row if x is not None}
+        if "periodo" in normed and "codigo subpartida" in normed:  # norm quita acentos
             return i
     return None
 
-def parse_fecha_any(x):
-    """
-    Soporta:
-      - 2020
-      - 2020/01
-      - 2020 / 01 - Enero
-    Devuelve: YYYY-MM-01
+# Esquema fijo de los CUODE: (campo interno, opciones de encabezado ya
+# normalizadas con norm). El orden de las opciones define la prioridad.
+_SCHEMA = [
+    ("fecha_txt", ("periodo", "periodo:")),
+    ("cod", ("codigo subpartida", "codigo subpartida:")),
+    ("label", ("subpartida", "descripcion", "descripcion:")),
+    ("grupo_cod", ("codigo grupo", "cod grupo", "codigo de grupo")),
+    ("grupo", ("grupo",)),
+    ("subgrupo_cod", ("codigo subgrupo", "cod subgrupo", "codigo de subgrupo")),
+    ("subgrupo", ("subgrupo",)),
+    ("peso", ("tm (peso neto)", "peso neto", "tm peso neto", "tm")),
+    ("fob", ("fob",)),
+    ("cif", ("cif",)),
+]
+
+# unión de las opciones del esquema; el resto de la hoja ni se materializa
+WANTED_NORMS = {o for _, opts in _SCHEMA for o in opts}
+
+
+def resolve_schema(norm_cols, schema):
+    """Mapea encabezado real -> campo interno según el primer match."""
+    rename = {}
+    for out, opts in schema:
+        for o in opts:
+            if o in norm_cols:
+                rename[norm_cols[o]] = out
+                break
+    return rename
+
+
+# Períodos soportados: "2020", "2020/01", "2020 / 01 - Enero" -> YYYY-MM-01.
+# Compilado una vez; se aplica vectorizado con Series.str.extract.
+_FECHA_RE = re.compile(r"(\d{4})(?:\s*/\s*(\d{1,2}))?")
+
+
+def df_to_records(df, cols):
+    """Materializa registros columna a columna.
+
+    Series.tolist() baja a C y desempaqueta los escalares numpy a tipos
+    Python de una vez; zip(*arrs) arma las filas sin el barrido por
+    celda de DataFrame.to_dict(orient="records").
     """
-    s = str(x).strip()
+    arrs = [df[c].tolist() for c in cols]
+    return [dict(zip(cols, row)) for row in zip(*arrs)]
 
-    m = re.search(r"(\d{4})\s*/\s*(\d{1,2})", s)
-    if m:
-        yyyy = m.group(1)
-        mm = int(m.group(2))
-        return f"{yyyy}-{mm:02d}-01"
 
-    m2 = re.search(r"(\d{4})", s)
-    if m2:
-        yyyy = m2.group(1)
-        return f"{yyyy}-01-01"
+def _process_one(filepath):
+    """Parsea y limpia un Excel CUODE completo.
+
+    Corre en un subproceso del pool (por eso vive a nivel de módulo).
+    Devuelve una lista [(año, registros)]; lanza ValueError si la
+    estructura del archivo no sirve.
+    """
+    # hoja 1 por defecto (en tus muestras: "Columnas"),
+    # leída en streaming una única vez
+    rows = _load_sheet_rows(filepath)
+
+    header_idx = find_header_row(rows)
+    if header_idx is None:
+        raise ValueError("No se detectó encabezado")
+
+    # reusar las mismas filas para armar el DataFrame, materializando solo
+    # las columnas que usa el ETL (equivalente a usecols, sin segundo parseo)
+    header = rows[header_idx]
+    keep_idx = [i for i, c in enumerate(header) if norm(c) in WANTED_NORMS]
+    df = pd.DataFrame(
+        ([row[i] if i < len(row) else None for i in keep_idx]
+         for row in rows[header_idx + 1:]),
+        columns=[str(header[i]).strip() for i in keep_idx],
+    )
+
+    # normalización columnas contra el esquema fijo
+    norm_cols = {norm(c): c for c in df.columns}
+    rename = resolve_schema(norm_cols, _SCHEMA)
+
+    # mínimos
+    if not {"fecha_txt", "cod"} <= set(rename.values()):
+        raise ValueError(f"Columnas clave faltantes. Columnas: {list(df.columns)}")
+
+    df = df.rename(columns=rename)
+
+    # fecha (extract vectorizado; mes ausente => enero)
+    ext = df["fecha_txt"].astype(str).str.extract(_FECHA_RE)
+    yyyy = ext[0]
+    mm = ext[1].fillna("1").astype(int)
+    df["fecha"] = yyyy + "-" + mm.map("{:02d}".format) + "-01"
+    df.loc[yyyy.isna(), "fecha"] = None
+    df = df.dropna(subset=["fecha", "cod"]).copy()
+
+    # cod subpartida limpio: un solo scan del string (quita el
+    # ".0" de floats y puntos) y padding vectorizado, sin lambda
+    s = df["cod"].astype(str).str.replace(r"\.0?$|\.", "", regex=True).str.strip()
+    mask = s.str.isdigit().fillna(False) & (s.str.len() < 10)
+    df["cod"] = np.where(mask, s.str.zfill(10), s)
+
+    # label: misma limpieza que clean_text pero vectorizada
+    # (clean_text queda como fallback escalar)
+    if "label" in df.columns:
+        df["label"] = (
+            df["label"].fillna("Desconocido").astype(str)
+            .str.replace(r"\(.*?\)", "", regex=True)
+            .str.replace(r"\s+", " ", regex=True)
+            .str.strip()
+            .replace("", "Desconocido")
+        )
+    else:
+        df["label"] = "Desconocido"
+
+    # numéricos (downcast a float32: la mitad de bytes en groupby y escritura)
+    for c in ["fob", "cif", "peso"]:
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c], errors="coerce", downcast="float").fillna(0)
+
+    # grupo/subgrupo como texto (códigos pueden ser "01", "011")
+    if "grupo_cod" in df.columns:
+        df["grupo_cod"] = df["grupo_cod"].astype(str).str.strip()
+    else:
+        df["grupo_cod"] = ""
+
+    if "subgrupo_cod" in df.columns:
+        df["subgrupo_cod"] = df["subgrupo_cod"].astype(str).str.strip()
+    else:
+        df["subgrupo_cod"] = ""
+
+    if "grupo" not in df.columns:
+        df["grupo"] = ""
+    if "subgrupo" not in df.columns:
+        df["subgrupo"] = ""
+
+    # completar columnas faltantes una sola vez
+    cols = ["fecha", "cod", "label", "grupo_cod", "grupo", "subgrupo_cod", "subgrupo", "fob", "cif", "peso"]
+    for col in cols:
+        if col not in df.columns:
+            df[col] = "" if col in ["grupo_cod", "grupo", "subgrupo_cod", "subgrupo"] else 0
+
+    # textos muy repetidos como category y fuera la columna cruda del
+    # período: menos memoria viajando por el groupby y la serialización
+    for col in ["grupo_cod", "grupo", "subgrupo_cod", "subgrupo", "label"]:
+        df[col] = df[col].astype("category")
+    df = df.drop(columns=["fecha_txt"])
+
+    # de vuelta a float64 redondeado antes de publicar: el ruido de float32
+    # (3.3 -> 3.2999999523...) no debe llegar al JSON público
+    for col in ["fob", "cif", "peso"]:
+        df[col] = df[col].astype("float64").round(2)
+
+    # particionar por año: una sola pasada con groupby
+    results = []
+    for yr, sub in df.groupby(df["fecha"].str[:4], sort=True):
+        results.append((yr, df_to_records(sub, cols)))
+    return results
 
-    return None
 
 # ==============================================================================
 # ETL ENGINE (CUODE)
@@ -107,151 +269,61 @@ class ETLCuode:
         os.makedirs(API_OUTPUT_PATH, exist_ok=True)
 
         processed_files = 0
-        years_written = set()
-
-        for filepath in sorted(files):
-            filename = os.path.basename(filepath)
-            status.write(f"🔄 Procesando {filename}")
-
-            try:
-                # hoja 1 por defecto (en tus muestras: "Columnas")
-                xls = pd.ExcelFile(filepath)
-                sheet = xls.sheet_names[0] if xls.sheet_names else None
-
-                header_idx = find_header_row(filepath, sheet_name=sheet)
-                if header_idx is None:
-                    status.warning(f"⚠️ No se detectó encabezado en {filename}.")
-                    continue
-
-                df = pd.read_excel(filepath, sheet_name=sheet, header=header_idx, engine="openpyxl")
-                df.columns = df.columns.astype(str).str.strip()
-                df = df.loc[:, ~df.columns.str.contains("^Unnamed", na=False)]  # elimina Unnamed
-
-                # normalización columnas
-                norm_cols = {norm(c): c for c in df.columns}
-
-                def pick(*opts):
-                    for o in opts:
-                        if o in norm_cols:
-                            return norm_cols[o]
-                    return None
-
-                col_periodo = pick("periodo", "periodo:")
-                col_grupo_cod = pick("codigo grupo", "cod grupo", "codigo de grupo")
-                col_grupo = pick("grupo")
-                col_subgrupo_cod = pick("codigo subgrupo", "cod subgrupo", "codigo de subgrupo")
-                col_subgrupo = pick("subgrupo")
-                col_cod = pick("codigo subpartida", "codigo subpartida:")
-                col_desc = pick("subpartida", "descripcion", "descripcion:")
-                col_peso = pick("tm (peso neto)", "peso neto", "tm peso neto", "tm")
-                col_fob = pick("fob")
-                col_cif = pick("cif")
-
-                # mínimos
-                if not col_periodo or not col_cod:
-                    status.warning(f"⚠️ Columnas clave faltantes en {filename}. Columnas: {list(df.columns)}")
-                    continue
-
-                rename = {col_periodo: "fecha_txt", col_cod: "cod"}
-                if col_desc: rename[col_desc] = "label"
-                if col_grupo_cod: rename[col_grupo_cod] = "grupo_cod"
-                if col_grupo: rename[col_grupo] = "grupo"
-                if col_subgrupo_cod: rename[col_subgrupo_cod] = "subgrupo_cod"
-                if col_subgrupo: rename[col_subgrupo] = "subgrupo"
-                if col_peso: rename[col_peso] = "peso"
-                if col_fob: rename[col_fob] = "fob"
-                if col_cif: rename[col_cif] = "cif"
-
-                df = df.rename(columns=rename)
-
-                # fecha
-                df["fecha"] = df["fecha_txt"].apply(parse_fecha_any)
-                df = df.dropna(subset=["fecha", "cod"]).copy()
-
-                # cod subpartida limpio
-                df["cod"] = (
-                    df["cod"].astype(str)
-                    .str.replace(".0", "", regex=False)
-                    .str.replace(".", "", regex=False)
-                    .str.strip()
-                )
-                df["cod"] = df["cod"].apply(lambda x: x.zfill(10) if x.isdigit() and len(x) < 10 else x)
-
-                # label
-                df["label"] = df["label"].apply(self.clean_text) if "label" in df.columns else "Desconocido"
-
-                # numéricos
-                for c in ["fob", "cif", "peso"]:
-                    if c in df.columns:
-                        df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0)
-
-                # grupo/subgrupo como texto (códigos pueden ser "01", "011")
-                if "grupo_cod" in df.columns:
-                    df["grupo_cod"] = df["grupo_cod"].astype(str).str.strip()
-                else:
-                    df["grupo_cod"] = ""
-
-                if "subgrupo_cod" in df.columns:
-                    df["subgrupo_cod"] = df["subgrupo_cod"].astype(str).str.strip()
-                else:
-                    df["subgrupo_cod"] = ""
-
-                if "grupo" not in df.columns:
-                    df["grupo"] = ""
-                if "subgrupo" not in df.columns:
-                    df["subgrupo"] = ""
-
-                # escribir por año
-                years = sorted(df["fecha"].str[:4].unique())
-                for yr in years:
-                    sub = df[df["fecha"].str.startswith(yr)].copy()
-
-                    out_file = os.path.join(API_OUTPUT_PATH, f"{yr}.json")
-                    cols = ["fecha", "cod", "label", "grupo_cod", "grupo", "subgrupo_cod", "subgrupo", "fob", "cif", "peso"]
-                    for col in cols:
-                        if col not in sub.columns:
-                            sub[col] = "" if col in ["grupo_cod", "grupo", "subgrupo_cod", "subgrupo"] else 0
-
-                    sub[cols].to_json(out_file, orient="records", force_ascii=False)
-
-                    years_written.add(yr)
-
-                processed_files += 1
-
-            except Exception as e:
-                status.error(f"❌ Error en {filename}: {e}")
-
-        # summary.json (listado de años + total CIF)
-        if years_written:
-            summary = []
-            for yr in sorted(years_written, reverse=True):
-                p = os.path.join(API_OUTPUT_PATH, f"{yr}.json")
+        year_records = {}
+
+        # cada archivo es independiente y CPU-bound (parseo + regex):
+        # un proceso por archivo escala casi lineal con los cores
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+            futures = {pool.submit(_process_one, f): os.path.basename(f)
+                       for f in sorted(files)}
+            # mergear en orden de envío (no as_completed): el contenido de
+            # cada {yr}.json no debe depender del scheduling del pool, o el
+            # publish a GitHub Pages empujaría diffs espurios byte a byte
+            for fut, filename in futures.items():
                 try:
-                    d = pd.read_json(p)
-                    total = float(d["cif"].sum()) if "cif" in d.columns else 0.0
-                except Exception:
-                    total = 0.0
-                summary.append({"year": yr, "total_cif": round(total, 2), "file": f"{yr}.json"})
+                    for yr, records in fut.result():
+                        year_records.setdefault(yr, []).extend(records)
+                    processed_files += 1
+                    status.write(f"🔄 {filename} ✔")
+                except ValueError as e:
+                    status.warning(f"⚠️ {e} en {filename}.")
+                except Exception as e:
+                    status.error(f"❌ Error en {filename}: {e}")
+
+        # escribir un JSON por año con los registros ya mergeados y acumular
+        # el total CIF en la misma pasada, sin re-leer lo recién escrito
+        summary = []
+        for yr in sorted(year_records, reverse=True):
+            records = year_records[yr]
+            out_file = os.path.join(API_OUTPUT_PATH, f"{yr}.json")
+
+            # orjson serializa 5-6x más rápido que el camino
+            # to_json de pandas y escribe bytes directo
+            with open(out_file, "wb") as f:
+                f.write(orjson.dumps(records))
+
+            total_cif = float(sum(r.get("cif") or 0 for r in records))
+            summary.append({"year": yr, "total_cif": round(total_cif, 2), "file": f"{yr}.json"})
 
+        # summary.json (listado de años + total CIF)
+        if summary:
             sum_path = os.path.join(API_OUTPUT_PATH, "summary.json")
-            with open(sum_path, "w", encoding="utf-8") as f:
-                json.dump(summary, f, ensure_ascii=False, indent=2)
+            with open(sum_path, "wb") as f:
+                f.write(orjson.dumps(summary, option=orjson.OPT_INDENT_2))
 
-        status.success(f"✅ ETL CUODE completo: {processed_files} archivos procesados. Años: {len(years_written)}.")
+        status.success(f"✅ ETL CUODE completo: {processed_files} archivos procesados. Años: {len(summary)}.")
         return processed_files > 0
 
     def git_push_changes(self):
         try:
-            run(["git", "status"], cwd=REPO_PATH)
             run(["git", "add", os.path.join("public", "data")], cwd=REPO_PATH)
 
-            diff = subprocess.run(
-                ["git", "diff", "--cached", "--name-only"],
+            # --quiet devuelve 0 si no hay nada staged, sin capturar texto
+            rc = subprocess.run(
+                ["git", "diff", "--cached", "--quiet"],
                 cwd=REPO_PATH,
-                capture_output=True,
-                text=True,
-            )
-            if not diff.stdout.strip():
+            ).returncode
+            if rc == 0:
                 return True, "No había cambios nuevos en public/data (nada que subir)."
 
             msg = f"Update CUODE APIs {datetime.now().strftime('%Y-%m-%d %H:%M')}"
@@ -261,12 +333,77 @@ class ETLCuode:
         except Exception as e:
             return False, str(e)
 
+# ==============================================================================
+# VALIDACIÓN (helpers cacheados)
+# ==============================================================================
+# cacheado por (ruta, mtime): los reruns de Streamlit no re-parsean ni
+# re-agregan mientras el archivo no cambie
+@st.cache_data(show_spinner=False)
+def _load_summary(path, mtime):
+    with open(path, "rb") as f:
+        return orjson.loads(f.read())
+
+
+@st.cache_data(show_spinner=False)
+def _year_aggregates(path, mtime):
+    """Total CIF, evolución mensual y top-50 del año seleccionado."""
+    if duckdb is not None:
+        total_cif = duckdb.execute(
+            "SELECT COALESCE(SUM(cif), 0) FROM read_json_auto(?)",
+            [path],
+        ).fetchone()[0]
+
+        evol = duckdb.execute(
+            """
+            SELECT date_trunc('month', CAST(fecha AS DATE)) AS fecha,
+                   SUM(cif) AS cif
+            FROM read_json_auto(?)
+            GROUP BY 1
+            ORDER BY 1
+            """,
+            [path],
+        ).df()
+
+        top = duckdb.execute(
+            """
+            SELECT cod, label, grupo, subgrupo,
+                   SUM(cif) AS cif, SUM(peso) AS peso
+            FROM read_json_auto(?)
+            GROUP BY 1, 2, 3, 4
+            ORDER BY cif DESC
+            LIMIT 50
+            """,
+            [path],
+        ).df()
+    else:
+        with open(path, "rb") as f:
+            df = pd.DataFrame(orjson.loads(f.read()))
+        total_cif = float(df["cif"].sum()) if "cif" in df.columns else 0.0
+
+        df["fecha"] = pd.to_datetime(df["fecha"])
+        evol = df.groupby(df["fecha"].dt.to_period("M"))["cif"].sum().reset_index()
+        evol["fecha"] = evol["fecha"].dt.to_timestamp()
+
+        top = (
+            df.groupby(["cod", "label", "grupo", "subgrupo"])[["cif", "peso"]]
+            .sum()
+            .reset_index()
+            .sort_values("cif", ascending=False)
+            .head(50)
+        )
+
+    return total_cif, evol, top
+
+
 # ==============================================================================
 # UI
 # ==============================================================================
 st.sidebar.title("China Data Hub")
 page = st.sidebar.radio("Menú", ["⚙️ Admin ETL CUODE", "📊 Validación (local)"])
 
+if lxml is None:
+    st.sidebar.caption("💡 `pip install lxml` acelera 2-4x la lectura de .xlsx")
+
 etl = ETLCuode()
 
 if page == "⚙️ Admin ETL CUODE":
@@ -303,7 +440,7 @@ elif page == "📊 Validación (local)":
         st.info("No hay summary.json todavía. Ve a Admin ETL CUODE y procesa.")
         st.stop()
 
-    summary = json.load(open(summary_path, encoding="utf-8"))
+    summary = _load_summary(summary_path, os.path.getmtime(summary_path))
     years = [x["year"] for x in summary]
     year = st.selectbox("Año", years)
 
@@ -312,20 +449,9 @@ elif page == "📊 Validación (local)":
         st.warning("No existe el JSON del año seleccionado.")
         st.stop()
 
-    df = pd.read_json(data_path)
-    st.metric("Total CIF (USD)", f"${df['cif'].sum():,.0f}" if "cif" in df.columns else "$0")
-
-    df["fecha"] = pd.to_datetime(df["fecha"])
-    evol = df.groupby(df["fecha"].dt.to_period("M"))["cif"].sum().reset_index()
-    evol["fecha"] = evol["fecha"].dt.to_timestamp()
+    total_cif, evol, top = _year_aggregates(data_path, os.path.getmtime(data_path))
+    st.metric("Total CIF (USD)", f"${total_cif:,.0f}")
 
     st.plotly_chart(px.area(evol, x="fecha", y="cif", title="Evolución CIF mensual (si aplica)"), use_container_width=True)
 
-    top = (
-        df.groupby(["cod", "label", "grupo", "subgrupo"])[["cif", "peso"]]
-        .sum()
-        .reset_index()
-        .sort_values("cif", ascending=False)
-        .head(50)
-    )
     st.dataframe(top, hide_index=True, use_container_width=True)
@@ -8,6 +8,14 @@ import subprocess
 import unicodedata
 import plotly.express as px
 from datetime import datetime
+from openpyxl import load_workbook
+
+# openpyxl usa lxml (parser C de libxml2) automáticamente si es importable:
+# 2-4x más rápido que xml.etree para shared-strings y hojas grandes
+try:
+    import lxml  # noqa: F401
+except ImportError:
+    lxml = None
 
 # ==============================================================================
 # CONFIG
@@ -27,23 +35,38 @@ DEFAULT_BRANCH = "main"  # cambia a "master" si tu repo usa master
 # HELPERS
 # ==============================================================================
 
-def norm(txt):
-    txt = "" if txt is None else str(txt)
-    txt = txt.strip().lower()
-    txt = "".join(
-        c
-        for c in unicodedata.normalize("NFD", txt)
-        if unicodedata.category(c) != "Mn"
-    )
-    txt = re.sub(r"\s+", " ", txt)
-    return txt
+# norm corre sobre cada nombre de columna Y cada celda del escaneo de
+# encabezados: regex precompilado y tabla de str.translate que quita las
+# marcas combinantes (categoría Mn) en C, sin genexp por carácter
+_WS_RE = re.compile(r"\s+")
+_COMBINING = dict.fromkeys(
+    c for c in range(0x10000) if unicodedata.category(chr(c)) == "Mn"
+)
 
 
-def find_header_row(filepath, max_rows=40):
-    preview = pd.read_excel(filepath, header=None, nrows=max_rows, engine="openpyxl")
-    for i in range(len(preview)):
-        row = [norm(x) for x in preview.iloc[i].tolist()]
-        if "codigo subpartida" in row and "periodo" in row:
+def norm(txt):
+    if txt is None:
+        return ""
+    s = unicodedata.normalize("NFD", str(txt)).translate(_COMBINING)
+    return _WS_RE.sub(" ", s.strip().lower())
+
+
+def _load_sheet_rows(filepath):
+    """Abre el workbook UNA sola vez en modo read_only y devuelve las filas
+    de la primera hoja como lista de tuplas."""
+    wb = load_workbook(filepath, read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb[wb.sheetnames[0]]
+        return list(ws.iter_rows(values_only=True))
+    finally:
+        wb.close()
+
+
+def find_header_row(rows, max_rows=40):
+    for i, row in enumerate(rows[:max_rows]):
+        # set: membership O(1); las celdas vacías (None) ni se normalizan
+        normed = {norm(x) for x in row if x is not None}
+        if "codigo subpartida" in normed and "periodo" in normed:
             return i
     return None
 
@@ -62,6 +85,52 @@ def is_export_file(filename: str) -> bool:
     return bool(re.search(r"\bexport\b", base))
 
 
+# Esquema fijo de los exports: (campo interno, opciones de encabezado ya
+# normalizadas con norm). El orden de las opciones define la prioridad.
+_SCHEMA = [
+    ("fecha_txt", ("periodo",)),
+    ("pais", ("pais origen", "pais de origen")),
+    ("cod", ("codigo subpartida",)),
+    ("desc", ("subpartida", "descripcion")),
+    ("peso", ("tm (peso neto)", "peso neto")),
+    ("fob", ("fob",)),
+    ("cif", ("cif",)),  # a veces viene, pero en exports usamos FOB
+]
+
+
+def resolve_schema(norm_cols, schema):
+    """Mapea encabezado real -> campo interno según el primer match."""
+    rename = {}
+    for out, opts in schema:
+        for o in opts:
+            if o in norm_cols:
+                rename[norm_cols[o]] = out
+                break
+    return rename
+
+
+# Basura inicial y paréntesis en descripciones, compilado una sola vez
+_EXP_RE = re.compile(r"^(?:LOS DEMÁS|LAS DEMÁS|OTROS|OTRAS)\s*|\(.*?\)")
+
+
+# Sector por capítulo arancelario (2 primeros dígitos de la subpartida)
+SECTORS = {
+    "03": "🦐 Pesca",
+    "07": "🥦 Hortalizas",
+    "08": "🍌 Frutas",
+    "16": "🥫 Conservas",
+    "18": "🍫 Cacao",
+    "29": "🧪 Químicos",
+    "30": "💊 Farma",
+    "39": "🧴 Plásticos",
+    "44": "🪵 Madera",
+    "72": "🏗️ Hierro/Acero",
+    "84": "⚙️ Maquinaria",
+    "85": "🔌 Eléctrico",
+    "87": "🚗 Vehículos",
+}
+
+
 # ==============================================================================
 # ETL ENGINE (solo exports)
 # ==============================================================================
@@ -76,25 +145,6 @@ class ExportETL:
         txt = txt.strip()
         return txt.capitalize() if txt else "Desconocido"
 
-    def get_sector(self, code):
-        cap = str(code)[:2]
-        sectors = {
-            "03": "🦐 Pesca",
-            "07": "🥦 Hortalizas",
-            "08": "🍌 Frutas",
-            "16": "🥫 Conservas",
-            "18": "🍫 Cacao",
-            "29": "🧪 Químicos",
-            "30": "💊 Farma",
-            "39": "🧴 Plásticos",
-            "44": "🪵 Madera",
-            "72": "🏗️ Hierro/Acero",
-            "84": "⚙️ Maquinaria",
-            "85": "🔌 Eléctrico",
-            "87": "🚗 Vehículos",
-        }
-        return sectors.get(cap, "📦 Otros")
-
     def run_process(self, raw_data_path: str, status):
         status.write(f"📂 Leyendo: `{raw_data_path}`")
 
@@ -120,44 +170,32 @@ class ExportETL:
             status.write(f"🔄 {filename}")
 
             try:
-                header_idx = find_header_row(filepath)
+                rows = _load_sheet_rows(filepath)
+
+                header_idx = find_header_row(rows)
                 if header_idx is None:
                     status.warning(
                         f"⚠️ No se detectó encabezado (Período + Código Subpartida) en {filename}"
                     )
                     continue
 
-                df = pd.read_excel(filepath, header=header_idx, dtype=str, engine="openpyxl")
-                df.columns = df.columns.astype(str).str.strip()
-                df = df.loc[:, ~df.columns.str.contains("^Unnamed", na=False)]
+                # reusar las mismas filas del escaneo: sin segundo parseo del xlsx
+                df = pd.DataFrame(rows[header_idx + 1:],
+                                  columns=[str(c).strip() for c in rows[header_idx]])
+                df = df.loc[:, [c not in ("None", "") for c in df.columns]]  # headers vacíos
 
-                # columnas normalizadas
+                # columnas normalizadas contra el esquema fijo
                 norm_cols = {norm(c): c for c in df.columns}
+                rename = resolve_schema(norm_cols, _SCHEMA)
 
-                def pick(*opts):
-                    for o in opts:
-                        if o in norm_cols:
-                            return norm_cols[o]
-                    return None
-
-                rename = {}
-                rename[pick("periodo", "período")] = "fecha_txt"
-                rename[pick("pais origen", "país origen", "pais de origen", "país de origen")] = "pais"
-                rename[pick("codigo subpartida", "código subpartida")] = "cod"
-                rename[pick("subpartida", "descripcion", "descripción")] = "desc"
-                rename[pick("tm (peso neto)", "peso neto")] = "peso"
-                rename[pick("fob")] = "fob"
-                rename[pick("cif")] = "cif"  # a veces viene, pero en exports usamos FOB
-                rename = {k: v for k, v in rename.items() if k is not None}
-
-                df = df.rename(columns=rename)
-
-                if "cod" not in df.columns or "fecha_txt" not in df.columns:
+                if not {"fecha_txt", "cod"} <= set(rename.values()):
                     status.warning(
                         f"⚠️ Faltan columnas clave en {filename}. Halladas: {list(df.columns)}"
                     )
                     continue
 
+                df = df.rename(columns=rename)
+
                 # Fecha "YYYY / MM - Mes" -> "YYYY-MM-01"
                 def parse_fecha(txt):
                     m = re.search(r"(\d{4})\s*/\s*(\d{2})", str(txt))
@@ -166,26 +204,48 @@ class ExportETL:
                 df["fecha"] = df["fecha_txt"].apply(parse_fecha)
                 df = df.dropna(subset=["fecha", "cod"])
 
-                # numéricos
+                # numéricos (downcast: la mitad de bytes por columna)
                 for c in ["fob", "cif", "peso"]:
                     if c in df.columns:
-                        df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0)
+                        df[c] = pd.to_numeric(df[c], errors="coerce", downcast="float").fillna(0)
 
                 df["cod"] = (
                     df["cod"].astype(str).str.replace(".", "", regex=False).str.strip().str.zfill(10)
                 )
-                df["sector"] = df["cod"].apply(self.get_sector)
-                df["label"] = df["desc"].apply(self.clean_text) if "desc" in df.columns else "Desconocido"
-
-                years = sorted(df["fecha"].str[:4].unique())
-
-                for yr in years:
-                    sub = df[df["fecha"].str.startswith(yr)].copy()
-                    cols = ["fecha", "cod", "label", "sector", "fob", "cif", "peso"]
-                    for c in cols:
-                        if c not in sub.columns:
-                            sub[c] = 0 if c in ["fob", "cif", "peso"] else ""
+                df["sector"] = df["cod"].str[:2].map(SECTORS).fillna("📦 Otros")
+                # misma limpieza que clean_text pero vectorizada
+                # (clean_text queda como fallback escalar)
+                if "desc" in df.columns:
+                    df["label"] = (
+                        df["desc"].fillna("Desconocido").astype(str)
+                        .str.upper()
+                        .str.replace(_EXP_RE, "", regex=True)
+                        .str.strip()
+                        .str.capitalize()
+                        .replace("", "Desconocido")
+                    )
+                else:
+                    df["label"] = "Desconocido"
+
+                # completar columnas faltantes una sola vez, antes de particionar
+                cols = ["fecha", "cod", "label", "sector", "fob", "cif", "peso"]
+                for c in cols:
+                    if c not in df.columns:
+                        df[c] = 0 if c in ["fob", "cif", "peso"] else ""
+
+                # textos repetidos como category y fuera el período crudo:
+                # menos bytes moviéndose por la partición y la escritura
+                for c in ["label", "sector"]:
+                    df[c] = df[c].astype("category")
+                df = df.drop(columns=["fecha_txt"])
+
+                # de vuelta a float64 redondeado antes de publicar: el ruido
+                # de float32 (3.3 -> 3.2999999523...) no debe llegar al JSON
+                for c in ["fob", "cif", "peso"]:
+                    df[c] = df[c].astype("float64").round(2)
 
+                # una sola pasada con groupby en vez de un scan por cada año
+                for yr, sub in df.groupby(df["fecha"].str[:4], sort=True):
                     out_path = os.path.join(API_OUTPUT_PATH, f"{yr}.json")
                     sub[cols].to_json(out_path, orient="records", force_ascii=False)
 
@@ -209,18 +269,15 @@ class ExportETL:
 
     def git_push_changes(self):
         try:
-            run(["git", "status"], cwd=REPO_PATH)
-
             # add + commit (solo si hay cambios)
             run(["git", "add", "public/data/exports"], cwd=REPO_PATH)
 
-            diff = subprocess.run(
-                ["git", "diff", "--cached", "--name-only"],
+            # --quiet devuelve 0 si no hay nada staged, sin capturar texto
+            rc = subprocess.run(
+                ["git", "diff", "--cached", "--quiet"],
                 cwd=REPO_PATH,
-                capture_output=True,
-                text=True,
-            )
-            if not diff.stdout.strip():
+            ).returncode
+            if rc == 0:
                 return True, "No había cambios nuevos en public/data/exports (nada que subir)."
 
             msg = f"Update exports APIs {datetime.now().strftime('%Y-%m-%d %H:%M')}"
@@ -231,6 +288,39 @@ class ExportETL:
         except Exception as e:
             return False, str(e)
 
+# ==============================================================================
+# DASHBOARD (helpers cacheados)
+# ==============================================================================
+# cacheado por (ruta, mtime): los reruns de Streamlit no re-parsean ni
+# re-agregan mientras el archivo no cambie
+@st.cache_data(show_spinner=False)
+def _load_summary(path, mtime):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+@st.cache_data(show_spinner=False)
+def _year_aggregates(path, mtime):
+    """Total FOB, evolución mensual y top-50 del año seleccionado."""
+    df = pd.read_json(path)
+    total_fob = float(df["fob"].sum())
+
+    df["fecha"] = pd.to_datetime(df["fecha"], errors="coerce")
+    df = df.dropna(subset=["fecha"])
+
+    evol = df.groupby(df["fecha"].dt.to_period("M"))["fob"].sum().reset_index()
+    evol["fecha"] = evol["fecha"].dt.to_timestamp()
+
+    top = (
+        df.groupby(["cod", "label"])[["fob", "peso"]]
+        .sum()
+        .reset_index()
+        .sort_values("fob", ascending=False)
+        .head(50)
+    )
+    return total_fob, evol, top
+
+
 # ==============================================================================
 # UI
 # ==============================================================================
@@ -239,6 +329,9 @@ page = st.sidebar.radio("Menú", ["⚙️ Admin ETL (exports)", "📊 Dashboard
 
 raw_data_path = st.sidebar.text_input("Ruta de Excels (exports)", value=DEFAULT_RAW_DATA_PATH)
 
+if lxml is None:
+    st.sidebar.caption("💡 `pip install lxml` acelera 2-4x la lectura de .xlsx")
+
 etl = ExportETL()
 
 if page == "⚙️ Admin ETL (exports)":
@@ -275,7 +368,7 @@ elif page == "📊 Dashboard (exports)":
         st.info("No hay summary.json aún. Ve a Admin ETL y procesa los Excels.")
         st.stop()
 
-    years = [x["year"] for x in json.load(open(summary_path, encoding="utf-8"))]
+    years = [x["year"] for x in _load_summary(summary_path, os.path.getmtime(summary_path))]
     year = st.selectbox("Año", years)
 
     data_path = os.path.join(API_OUTPUT_PATH, f"{year}.json")
@@ -283,25 +376,12 @@ elif page == "📊 Dashboard (exports)":
         st.warning("No existe el JSON del año seleccionado.")
         st.stop()
 
-    df = pd.read_json(data_path)
-    st.metric("Total FOB USD", f"${df['fob'].sum():,.0f}")
-
-    df["fecha"] = pd.to_datetime(df["fecha"], errors="coerce")
-    df = df.dropna(subset=["fecha"])
-
-    evol = df.groupby(df["fecha"].dt.to_period("M"))["fob"].sum().reset_index()
-    evol["fecha"] = evol["fecha"].dt.to_timestamp()
+    total_fob, evol, top = _year_aggregates(data_path, os.path.getmtime(data_path))
+    st.metric("Total FOB USD", f"${total_fob:,.0f}")
 
     st.plotly_chart(
         px.area(evol, x="fecha", y="fob", title="Evolución mensual (FOB)"),
         use_container_width=True,
     )
 
-    top = (
-        df.groupby(["cod", "label"])[["fob", "peso"]]
-        .sum()
-        .reset_index()
-        .sort_values("fob", ascending=False)
-        .head(50)
-    )
     st.dataframe(top, hide_index=True, use_container_width=True)
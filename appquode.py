@@ -22,6 +22,13 @@ REPO_PATH = os.getcwd()
 API_OUTPUT_PATH = os.path.join(REPO_PATH, "public", "data", "importscuode")
 DEFAULT_BRANCH = "main"
 
+# calamine (Rust) lee los .xlsx mucho más rápido que openpyxl; úsalo si está.
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = "openpyxl"
+
 # ==============================================================================
 # HELPERS
 # ==============================================================================
@@ -47,6 +54,15 @@ def run(cmd, cwd=None):
     return res.stdout
 
 
+# columnas (ya normalizadas con norm) que usa el ETL; usecols evita
+# parsear el resto de la hoja
+WANTED_COLS = {
+    "anio", "ano", "codigo cuode", "cuode",
+    "descripcion cuode", "descripcion", "valor cif", "cif",
+    "peso neto", "peso",
+}
+
+
 # ==============================================================================
 # ETL
 # ==============================================================================
@@ -73,7 +89,7 @@ class CuodeETL:
 
         os.makedirs(API_OUTPUT_PATH, exist_ok=True)
 
-        summary = []
+        summary = {}  # por año: el último archivo procesado de un año gana
         processed = 0
 
         for filepath in sorted(files):
@@ -81,7 +97,8 @@ class CuodeETL:
             status.write(f"🔄 Procesando {fname}")
 
             try:
-                df = pd.read_excel(filepath, dtype=str, engine="openpyxl")
+                df = pd.read_excel(filepath, dtype=str, engine=EXCEL_ENGINE,
+                                   usecols=lambda c: norm(c) in WANTED_COLS)
                 df.columns = df.columns.astype(str).str.strip()
 
                 # Normalizar columnas
@@ -119,17 +136,22 @@ class CuodeETL:
                 years = sorted(df["year"].unique())
 
                 for yr in years:
-                    sub = df[df["year"] == yr].copy()
+                    sub = df[df["year"] == yr]
+
+                    # el dashboard consume agregados por CUODE, no la tabla
+                    # cruda: publicar el groupby deja el JSON en KBs en vez de MBs
+                    metrics = {c: (c, "sum") for c in ("cif", "peso") if c in sub.columns}
+                    agg = sub.groupby(["cuode", "descripcion"], as_index=False).agg(**metrics)
+
                     out = os.path.join(API_OUTPUT_PATH, f"{yr}.json")
-                    sub.to_json(out, orient="records", force_ascii=False)
+                    agg.to_json(out, orient="records", force_ascii=False)
 
-                    summary = [x for x in summary if x["year"] != yr]
-                    summary.append({
+                    summary[yr] = {
                         "year": yr,
                         "records": len(sub),
                         "total_cif": round(float(sub["cif"].sum()), 2),
                         "file": f"{yr}.json"
-                    })
+                    }
 
                 processed += 1
 
@@ -137,9 +159,9 @@ class CuodeETL:
                 status.error(f"❌ Error en {fname}: {e}")
 
         if summary:
-            summary.sort(key=lambda x: x["year"], reverse=True)
+            data = sorted(summary.values(), key=lambda x: x["year"], reverse=True)
             with open(os.path.join(API_OUTPUT_PATH, "summary.json"), "w", encoding="utf-8") as f:
-                json.dump(summary, f, ensure_ascii=False, indent=2)
+                json.dump(data, f, ensure_ascii=False, indent=2)
 
         status.success(f"✅ ETL CUODE completo: {processed} archivos procesados")
         return processed > 0
@@ -148,12 +170,13 @@ class CuodeETL:
         try:
             run(["git", "add", "public/data/importscuode"], cwd=REPO_PATH)
 
-            diff = subprocess.run(
-                ["git", "diff", "--cached", "--name-only"],
-                cwd=REPO_PATH, capture_output=True, text=True
-            )
+            # --quiet devuelve 0 si no hay nada staged, sin capturar texto
+            rc = subprocess.run(
+                ["git", "diff", "--cached", "--quiet"],
+                cwd=REPO_PATH
+            ).returncode
 
-            if not diff.stdout.strip():
+            if rc == 0:
                 return True, "No había cambios nuevos que publicar."
 
             msg = f"Update CUODE APIs {datetime.now().strftime('%Y-%m-%d %H:%M')}"